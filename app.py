@@ -6,12 +6,22 @@ Powered by Hume TTS + D-ID
 import streamlit as st
 import requests
 import base64
+import io
 import time
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
 from pathlib import Path
+from PIL import Image, ImageOps
+from typing import BinaryIO
+from requests.adapters import HTTPAdapter
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+from urllib3.util.retry import Retry
 
 # Config - check secrets first, then env vars
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_secret(key):
     """Get secret from Streamlit secrets or environment"""
     try:
@@ -21,19 +31,44 @@ def get_secret(key):
 
 HUME_API_KEY = get_secret("HUME_API_KEY")
 DID_API_KEY = get_secret("DID_API_KEY")
+# Optional publicly reachable URL for the default avatar - skips the upload
+DEFAULT_AVATAR_URL = get_secret("DEFAULT_AVATAR_URL")
 CLAIRE_VOICE_ID = "09eccfe9-8068-42c3-8f0a-e91f5d50d160"
+MAX_SCRIPT_LENGTH = 1000
+
+# User avatars larger than this are downscaled before upload
+MAX_AVATAR_SIZE = 1024
+MAX_AVATAR_BYTES = 500 * 1024
+
+# (connect, read) timeout applied to every API call
+REQUEST_TIMEOUT = (5, 60)
+
+# Shared HTTP session - cached across reruns so TLS connections are reused.
+# One instance serves every browser session on the server.
+@st.cache_resource(show_spinner=False)
+def get_session() -> requests.Session:
+    """Create a pooled, retrying HTTP session shared by all API calls"""
+    session = requests.Session()
+    # None of these APIs use cookies; never share a cookie jar between users
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    # Each generation uses up to 3 worker threads; size the pool per host
+    # for several concurrent users
+    session.mount("https://", HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=32,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+    ))
+    # Compress JSON metadata responses (status polls, errors)
+    session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+    return session
+
+SESSION = get_session()
 
 # Load avatar image
 AVATAR_PATH = Path(__file__).parent / "assets" / "chef-avatar.png"
 
-st.set_page_config(
-    page_title="AI Video Generator",
-    page_icon="🎬",
-    layout="centered"
-)
-
-# IPAI Branding CSS
-st.markdown("""
+# Static HTML blocks
+CSS = """
 <style>
     .stApp { background-color: #2d2d2d; }
     h1 {
@@ -48,7 +83,22 @@ st.markdown("""
         font-weight: 600;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+FOOTER_HTML = (
+    "<div style='text-align: center; color: gray; font-size: 0.8em;'>"
+    "Powered by Hume AI + D-ID | Created by Inception Point AI"
+    "</div>"
+)
+
+st.set_page_config(
+    page_title="AI Video Generator",
+    page_icon="🎬",
+    layout="centered"
+)
+
+# IPAI Branding CSS
+st.markdown(CSS, unsafe_allow_html=True)
 
 # Header with logo
 col1, col2 = st.columns([1, 5])
@@ -68,11 +118,12 @@ if not HUME_API_KEY or not DID_API_KEY:
 
 def generate_audio(text: str) -> bytes:
     """Generate audio using Hume TTS with Claire's voice"""
-    response = requests.post(
+    response = SESSION.post(
         "https://api.hume.ai/v0/tts/file",
         headers={
             "X-Hume-Api-Key": HUME_API_KEY,
-            "Content-Type": "application/json"
+            "Content-Type": "application/json",
+            "Accept-Encoding": "identity"  # MP3 is already compressed
         },
         json={
             "utterances": [{
@@ -80,30 +131,37 @@ def generate_audio(text: str) -> bytes:
                 "voice": {"id": CLAIRE_VOICE_ID}
             }],
             "format": {"type": "mp3"}
-        }
+        },
+        timeout=REQUEST_TIMEOUT
     )
     response.raise_for_status()
     return response.content
 
+_MIME_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'mp3': 'audio/mpeg',
+    'wav': 'audio/wav'
+}
+
 def get_mime_type(filename: str) -> str:
     """Get MIME type from filename"""
-    ext = filename.lower().split('.')[-1]
-    mime_types = {
-        'png': 'image/png',
-        'jpg': 'image/jpeg',
-        'jpeg': 'image/jpeg',
-        'mp3': 'audio/mpeg',
-        'wav': 'audio/wav'
-    }
-    return mime_types.get(ext, 'application/octet-stream')
+    return _MIME_TYPES.get(filename.rpartition('.')[2].lower(), 'application/octet-stream')
 
-def upload_to_did(file_bytes: bytes, endpoint: str, field_name: str, filename: str) -> str:
-    """Upload file to D-ID and return the S3 URL"""
+def upload_to_did(file_obj: BinaryIO, endpoint: str, field_name: str, filename: str) -> str:
+    """Upload a file-like object to D-ID and return the S3 URL"""
     mime_type = get_mime_type(filename)
-    response = requests.post(
+    # Stream the multipart body from file_obj instead of building it in memory
+    encoder = MultipartEncoder(fields={field_name: (filename, file_obj, mime_type)})
+    response = SESSION.post(
         f"https://api.d-id.com/{endpoint}",
-        headers={"Authorization": f"Basic {DID_API_KEY}"},
-        files={field_name: (filename, file_bytes, mime_type)}
+        headers={
+            "Authorization": f"Basic {DID_API_KEY}",
+            "Content-Type": encoder.content_type
+        },
+        data=encoder,
+        timeout=REQUEST_TIMEOUT
     )
     response.raise_for_status()
     return response.json()["url"]
@@ -111,7 +169,7 @@ def upload_to_did(file_bytes: bytes, endpoint: str, field_name: str, filename: s
 def create_video(image_url: str, audio_url: str) -> str:
     """Create a D-ID talk video and return the result URL"""
     # Create the talk
-    response = requests.post(
+    response = SESSION.post(
         "https://api.d-id.com/talks",
         headers={
             "Authorization": f"Basic {DID_API_KEY}",
@@ -123,17 +181,20 @@ def create_video(image_url: str, audio_url: str) -> str:
                 "type": "audio",
                 "audio_url": audio_url
             }
-        }
+        },
+        timeout=REQUEST_TIMEOUT
     )
     response.raise_for_status()
     talk_id = response.json()["id"]
     
-    # Poll for completion
-    for _ in range(60):  # Max 3 minutes
-        time.sleep(3)
-        status_response = requests.get(
+    # Poll for completion with exponential backoff (0.5s -> 3s), max 3 minutes
+    delay = 0.5
+    deadline = time.monotonic() + 180
+    while time.monotonic() < deadline:
+        status_response = SESSION.get(
             f"https://api.d-id.com/talks/{talk_id}",
-            headers={"Authorization": f"Basic {DID_API_KEY}"}
+            headers={"Authorization": f"Basic {DID_API_KEY}"},
+            timeout=REQUEST_TIMEOUT
         )
         status_response.raise_for_status()
         result = status_response.json()
@@ -142,9 +203,55 @@ def create_video(image_url: str, audio_url: str) -> str:
             return result["result_url"]
         elif result["status"] == "error":
             raise Exception(f"D-ID error: {result.get('error', 'Unknown error')}")
+        
+        time.sleep(delay)
+        delay = min(delay * 1.5, 3.0)
     
     raise Exception("Timeout waiting for video generation")
 
+def download_video(video_url: str) -> bytes:
+    """Download the finished video, streamed in 1 MiB chunks"""
+    with SESSION.get(
+        video_url,
+        headers={"Accept-Encoding": "identity"},  # MP4 is already compressed
+        stream=True,
+        timeout=REQUEST_TIMEOUT
+    ) as response:
+        response.raise_for_status()
+        buf = io.BytesIO()
+        for chunk in response.iter_content(chunk_size=1 << 20):
+            buf.write(chunk)
+    return buf.getvalue()
+
+def upload_avatar(uploaded_image: UploadedFile) -> str:
+    """Downscale a user avatar if it's large, then upload it to D-ID"""
+    uploaded_image.seek(0)
+    img = Image.open(uploaded_image)
+    if max(img.size) <= MAX_AVATAR_SIZE and uploaded_image.size <= MAX_AVATAR_BYTES:
+        uploaded_image.seek(0)
+        return upload_to_did(uploaded_image, "images", "image", uploaded_image.name)
+    
+    # Phone photos are often 5-12 MB; D-ID downsamples them anyway
+    img = ImageOps.exif_transpose(img)
+    if "A" in img.getbands() or "transparency" in img.info:
+        # JPEG has no alpha - flatten transparent backgrounds onto white
+        rgba = img.convert("RGBA")
+        img = Image.new("RGB", rgba.size, (255, 255, 255))
+        img.paste(rgba, mask=rgba.getchannel("A"))
+    else:
+        img = img.convert("RGB")
+    img.thumbnail((MAX_AVATAR_SIZE, MAX_AVATAR_SIZE), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=88, optimize=True)
+    buf.seek(0)
+    return upload_to_did(buf, "images", "image", "avatar.jpg")
+
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def get_default_avatar_url() -> str:
+    """Upload the default Claire avatar once and reuse its D-ID URL"""
+    with open(AVATAR_PATH, "rb") as f:
+        return upload_to_did(f, "images", "image", "avatar.png")
+
 # Main UI
 st.markdown("---")
 
@@ -174,70 +281,93 @@ st.subheader("💬 Script")
 script = st.text_area(
     "What should they say?",
     placeholder="Hi everyone! Today we're making the most delicious pasta you've ever tasted...",
-    height=150
+    height=150,
+    max_chars=MAX_SCRIPT_LENGTH
 )
 
 # Determine if we can generate
 can_generate = script and (avatar_option == "Use default (Claire)" or uploaded_image is not None)
+too_long = len(script) > MAX_SCRIPT_LENGTH
+if too_long:
+    st.error(f"Script too long! Keep it under {MAX_SCRIPT_LENGTH} characters.")
 
 # Generate button
-if st.button("🎬 Generate Video", type="primary", disabled=not can_generate):
-    if len(script) > 1000:
-        st.error("Script too long! Keep it under 1000 characters.")
-    else:
-        with st.status("Creating your video...", expanded=True) as status:
-            try:
-                # Step 1: Generate audio
-                st.write("🎙️ Generating voice...")
-                audio_bytes = generate_audio(script)
-                st.write("✅ Audio generated!")
-                
-                # Step 2: Upload image (custom or default)
-                st.write("📤 Uploading avatar...")
+if st.button("🎬 Generate Video", type="primary", disabled=not can_generate or too_long):
+    # A click can arrive with newly typed text in the same rerun, before the
+    # button is disabled, so re-check the length before calling any API
+    if too_long:
+        st.stop()
+    
+    # Clear any previous result
+    st.session_state.pop("video_url", None)
+    st.session_state.pop("video_bytes", None)
+    
+    with st.status("Creating your video...", expanded=True) as status:
+        try:
+            with ThreadPoolExecutor(max_workers=3) as ex:
+                # Step 1: Generate audio and upload avatar in parallel
+                fut_audio = ex.submit(generate_audio, script)
                 if uploaded_image is not None:
-                    image_bytes = uploaded_image.getvalue()
-                    image_url = upload_to_did(image_bytes, "images", "image", uploaded_image.name)
+                    st.write("🎙️ Generating voice and 📤 uploading avatar...")
+                    fut_image = ex.submit(upload_avatar, uploaded_image)
+                elif DEFAULT_AVATAR_URL:
+                    st.write("🎙️ Generating voice...")
+                    fut_image = None
                 else:
-                    with open(AVATAR_PATH, "rb") as f:
-                        image_bytes = f.read()
-                    image_url = upload_to_did(image_bytes, "images", "image", "avatar.png")
-                st.write("✅ Avatar uploaded!")
-                
-                # Step 3: Upload audio
-                st.write("📤 Uploading audio...")
-                audio_url = upload_to_did(audio_bytes, "audios", "audio", "speech.mp3")
-                st.write("✅ Audio uploaded!")
-                
-                # Step 4: Create video
-                st.write("🎥 Generating video (this takes ~30 seconds)...")
-                video_url = create_video(image_url, audio_url)
-                st.write("✅ Video ready!")
+                    st.write("🎙️ Generating voice and 📤 uploading avatar...")
+                    # Default avatar URL is cached after the first upload
+                    fut_image = ex.submit(get_default_avatar_url)
                 
-                status.update(label="Video complete!", state="complete")
-                
-                # Download and display
-                video_response = requests.get(video_url)
-                video_bytes = video_response.content
+                audio_bytes = fut_audio.result()
+                st.write("✅ Audio generated!")
                 
-                st.video(video_bytes)
+                # Step 2: Upload audio while the avatar upload finishes
+                st.write("📤 Uploading audio...")
+                fut_audio_up = ex.submit(upload_to_did, io.BytesIO(audio_bytes), "audios", "audio", "speech.mp3")
                 
-                # Download button
-                st.download_button(
-                    label="⬇️ Download Video",
-                    data=video_bytes,
-                    file_name="talking-avatar.mp4",
-                    mime="video/mp4"
-                )
+                if fut_image is not None:
+                    image_url = fut_image.result()
+                    st.write("✅ Avatar uploaded!")
+                else:
+                    image_url = DEFAULT_AVATAR_URL
                 
+                audio_url = fut_audio_up.result()
+                st.write("✅ Audio uploaded!")
+            
+            # Step 3: Create video
+            st.write("🎥 Generating video (this takes ~30 seconds)...")
+            video_url = create_video(image_url, audio_url)
+            st.write("✅ Video ready!")
+            
+            status.update(label="Video complete!", state="complete")
+            
+            # Keep the URL across reruns; the browser streams it directly
+            st.session_state.video_url = video_url
+            
+        except Exception as e:
+            status.update(label="Error!", state="error")
+            st.error(f"Something went wrong: {str(e)}")
+
+# Play the video straight from its URL, only fetch bytes when downloading
+if st.session_state.get("video_url"):
+    st.video(st.session_state.video_url)
+    
+    if "video_bytes" not in st.session_state:
+        if st.button("⬇️ Prepare Download"):
+            try:
+                with st.spinner("Fetching video..."):
+                    st.session_state.video_bytes = download_video(st.session_state.video_url)
             except Exception as e:
-                status.update(label="Error!", state="error")
                 st.error(f"Something went wrong: {str(e)}")
+    
+    if "video_bytes" in st.session_state:
+        st.download_button(
+            label="⬇️ Download Video",
+            data=st.session_state.video_bytes,
+            file_name="talking-avatar.mp4",
+            mime="video/mp4"
+        )
 
 # Footer
 st.markdown("---")
-st.markdown(
-    "<div style='text-align: center; color: gray; font-size: 0.8em;'>"
-    "Powered by Hume AI + D-ID | Created by Inception Point AI"
-    "</div>",
-    unsafe_allow_html=True
-)
+st.markdown(FOOTER_HTML, unsafe_allow_html=True)